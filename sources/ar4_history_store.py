@@ -0,0 +1,194 @@
+from typing import List, Dict, Optional, Tuple
+Unit_datetime = Tuple[int, int, int, int, int, int]
+
+from datetime import datetime
+from time import perf_counter
+import struct
+import os
+
+from sources.ar4_parser import Ar4Parser
+
+
+# Хранилище истории прибора: для каждого серийного номера записи хранятся
+# в исходном бинарном виде в файлах по суткам
+#     {root_dir}/{unit_number}/{YYYY_MM}/{YYYY_MM_DD}.{file_ext}
+# Внутри файла записи отсортированы по упакованной временной метке и не
+# повторяются, поэтому пересекающиеся архивы .AR4 не дублируют данные.
+class Ar4HistoryStore():
+
+    def __init__(self, root_dir: str = 'history'):
+        self.root_dir = root_dir
+        self.file_ext = 'ar4r'
+        self.file_sep = ';'
+        self.__ar4_parser = Ar4Parser()
+        self.__no_datetime = 0xffffffff
+
+    def get_timestamp(self, record: bytes) -> int:
+        return struct.unpack_from('<I', record, 2)[0]
+
+    # int_date - старшие 15 бит упакованной метки: год, месяц, день.
+    def __make_partition_path(self, unit_number: int, int_date: int) -> str:
+        year = (int_date >> 9) + 2000
+        month = (int_date >> 5 & 0b1111) + 1
+        day = (int_date & 0b11111) + 1
+        return os.path.join(
+            self.root_dir, str(unit_number), f'{year:d}_{month:02d}',
+            f'{year:d}_{month:02d}_{day:02d}.{self.file_ext}')
+
+    def __is_valid(self, record: bytes) -> bool:
+        return len(record) >= 6 and len(record) == record[1]
+
+    # Разбор файла суток с проверкой длины: неполная запись в конце файла
+    # или запись с неверной длиной (в том числе нулевой) завершает разбор,
+    # а не приводит к ошибке или бесконечному циклу.
+    def __split_records(self, data: bytes) -> List[bytes]:
+        result = []
+        empty = self.__ar4_parser.empty_byte[0]
+        i = 0
+        while i + 1 < len(data):
+            if data[i] == empty:
+                i += 1
+                continue
+            length = data[i+1]
+            if length < 6 or i + length > len(data):
+                break
+            result.append(data[i:i+length])
+            i += length
+        return result
+
+    def read_partition(self, path: str) -> List[bytes]:
+        try:
+            with open(path, 'rb') as f:
+                return self.__split_records(f.read())
+        except IOError as err:
+            print(f'Error with <{path}>:\n{err}.')
+        return []
+
+    # Файл суток всегда записывается во временный файл и затем заменяется
+    # целиком, поэтому сбой во время записи не оставляет неполных записей.
+    def __write_partition(self, path: str, records: List[bytes]) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(b''.join(records))
+        os.replace(tmp_path, path)
+        return None
+
+    # Архив прибора - кольцевой буфер: после переполнения новые записи
+    # затирают старые, поэтому порядок записей в снимке нарушается, а на
+    # границе затирания может оказаться неполная запись. Записи с неверной
+    # длиной и без временной метки отбрасываются, остальные сортируются.
+    def __group_records(self, records: List[bytes]) -> Dict[int, List[bytes]]:
+        unique: Dict[int, bytes] = {}
+        for record in records:
+            if not self.__is_valid(record):
+                continue
+            ts = self.get_timestamp(record)
+            if ts != self.__no_datetime and ts not in unique:
+                unique[ts] = record
+        result: Dict[int, List[bytes]] = {}
+        for ts in sorted(unique):
+            int_date = ts >> 17
+            if int_date in result:
+                result[int_date].append(unique[ts])
+            else:
+                result[int_date] = [unique[ts]]
+        return result
+
+    def __merge_partition(self, path: str, records: List[bytes]) -> int:
+        if not os.path.exists(path):
+            self.__write_partition(path, records)
+            return len(records)
+        stored = self.read_partition(path)
+        last_ts = self.get_timestamp(stored[-1]) if stored else -1
+        if self.get_timestamp(records[0]) > last_ts:
+            self.__write_partition(path, stored + records)
+            return len(records)
+        merged = {self.get_timestamp(record): record for record in stored}
+        added = 0
+        for record in records:
+            ts = self.get_timestamp(record)
+            if ts not in merged:
+                merged[ts] = record
+                added += 1
+        if added:
+            self.__write_partition(
+                path, [merged[ts] for ts in sorted(merged)])
+        return added
+
+    def add_records(self, unit_number: int, records: List[bytes]) -> int:
+        time_start = perf_counter()
+        added = 0
+        for int_date, partition_records in self.__group_records(records).items():
+            added += self.__merge_partition(
+                self.__make_partition_path(unit_number, int_date),
+                partition_records)
+        print('{} of {} records added to <{}> in {:.2f} ms.'.format(
+            added, len(records), unit_number,
+            (perf_counter() - time_start)*1e3))
+        return added
+
+    def import_ar4_file(self, filename: str) -> int:
+        raw_data = self.__ar4_parser.parse_ar4_file(filename)
+        return self.add_records(
+            raw_data['metadata']['unit_number'], raw_data['records'])
+
+    def __convert_datetime(self, unit_datetime: Unit_datetime,
+        title: str) -> Optional[int]:
+        try:
+            dt = tuple(datetime(*unit_datetime).timetuple())[:6]
+        except ValueError as err:
+            print(f'Wrong {title} timestamp: {err}.')
+            return None
+        return self.__ar4_parser.convert_unit_datetime_to_int(dt)
+
+    def __find_partitions(self, unit_number: int, start_ts: int,
+        end_ts: int) -> List[str]:
+        first = self.__make_partition_path(unit_number, start_ts >> 17)
+        last = self.__make_partition_path(unit_number, end_ts >> 17)
+        unit_dir = os.path.join(self.root_dir, str(unit_number))
+        first_month = os.path.basename(os.path.dirname(first))
+        last_month = os.path.basename(os.path.dirname(last))
+        first_day = os.path.basename(first)
+        last_day = os.path.basename(last)
+        result = []
+        try:
+            months = sorted(os.listdir(unit_dir))
+        except OSError:
+            print(f'There is no history for <{unit_number}>.')
+            return result
+        for month in months:
+            if not first_month <= month <= last_month:
+                continue
+            for day in sorted(os.listdir(os.path.join(unit_dir, month))):
+                if day.endswith(self.file_ext) and first_day <= day <= last_day:
+                    result.append(os.path.join(unit_dir, month, day))
+        return result
+
+    def query(self, unit_number: int, start_datetime: Unit_datetime,
+        end_datetime: Unit_datetime) -> List[bytes]:
+        start_ts = self.__convert_datetime(start_datetime, 'start')
+        end_ts = self.__convert_datetime(end_datetime, 'end')
+        if start_ts is None or end_ts is None:
+            return []
+        time_start = perf_counter()
+        partitions = self.__find_partitions(unit_number, start_ts, end_ts)
+        result = []
+        for path in partitions:
+            result.extend([
+                record for record in self.read_partition(path)
+                if start_ts <= self.get_timestamp(record) < end_ts])
+        print('{} records read from {} partitions in {:.2f} ms.'.format(
+            len(result), len(partitions), (perf_counter() - time_start)*1e3))
+        return result
+
+    def export_time_period(self, unit_number: int,
+        start_datetime: Unit_datetime, end_datetime: Unit_datetime,
+        sep: Optional[str] = None) -> List[dict]:
+        file_sep = (sep or self.file_sep)
+        records = self.query(unit_number, start_datetime, end_datetime)
+        decrypted_records = self.__ar4_parser.decrypt_records(records)
+        if decrypted_records:
+            self.__ar4_parser.export_decrypted_records_to_file(
+                decrypted_records, unit_number, file_sep)
+        return decrypted_records
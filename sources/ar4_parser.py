@@ -207,7 +207,7 @@ class Ar4Parser():
         return self.extract_time_period(
             records, start_datetime, end_datetime)        
 
-    def extract_last_date(self, raw_date: dict) -> List[bytes]:
+    def extract_last_date(self, raw_data: dict) -> List[bytes]:
         return self.extract_one_date(
             raw_data['records'], raw_data['metadata']['max_datetime'])
 
@@ -296,6 +296,9 @@ class Ar4Parser():
         return '{}_{}-{}.{}'.format(unit_number, sdt, edt, _file_ext)
 
     def export_decrypted_records_to_file(self, records: List[dict], unit_number: int, sep: str) -> None:
+        if not records:
+            print(f'There are no records to export for <{unit_number}>.')
+            return None
         filename = self.create_filename(unit_number, records[0]['datetime'], records[-1]['datetime'])
         self.write_decrypted_records_to_file(records, filename, sep)
         return None
@@ -1,5 +1,6 @@
 import os
 import time
+from collections import deque
 from datetime import datetime, timedelta
 
 
@@ -137,6 +138,43 @@ class TM5103DataParser:
     def reduce_data(self, data, number_of_lines):
         return [line for i, line in enumerate(data) if i % number_of_lines == 0]
 
+    # Скользящее среднее по последним number_of_lines строкам: на каждую
+    # новую строку одно сложение и одно вычитание на канал.
+    def create_average_window(self, channel_count, number_of_lines):
+        return {
+            'size': number_of_lines, 'lines': deque(),
+            'sums': [0.0] * channel_count, 'counts': [0] * channel_count}
+
+    def update_average_window(self, window, values):
+        sums, counts = window['sums'], window['counts']
+        window['lines'].append(values)
+        for i, v in enumerate(values):
+            if v is not None:
+                sums[i] += v
+                counts[i] += 1
+        if len(window['lines']) > window['size']:
+            for i, v in enumerate(window['lines'].popleft()):
+                if v is not None:
+                    sums[i] -= v
+                    counts[i] -= 1
+        return [s / c if c else None for s, c in zip(sums, counts)]
+
+    def convert_to_str(self, value):
+        if value is None:
+            return 'None'
+        return '{:.6f}'.format(value).replace('.', ',')
+
+    def average_data(self, data, number_of_lines):
+        if not data:
+            return []
+        window = self.create_average_window(len(data[0]) - 1, number_of_lines)
+        result = []
+        for line in data:
+            values = [self.convert_to_float(el) for el in line[1:]]
+            average = self.update_average_window(window, values)
+            result.append([line[0]] + [self.convert_to_str(v) for v in average])
+        return result
+
     def extract_columns_new(self, data, columns):
         return [[line[c] for c in columns] for line in data]
 
@@ -169,15 +207,16 @@ class TM5103DataParser:
         # print(*reduced_data, sep='\n')
 
 
-data_parser = TM5103DataParser()
-# filename = './../(2023_09_22)_RA.txt'
-# filename = 'D:/JIHT/!2023/!Ларина/!Raw_ED/(2023_09_28)_Pyrocarbon/Reactor A/ARHrep/TM5103-4217863/StandartConfig/DB/230928141800/All_Chan.txt'
-filenames = [
-    'D:/JIHT/!2023/!Ларина/!Processed_ED/tm5103-4217863.txt',
-    'D:/JIHT/!2023/!Ларина/!Processed_ED/tm5103-4217905.txt',
-]
-substitution = {'tm5103-4217863': 'A', 'tm5103-4217905': 'B'}
-# date = '22.09.2023'
-date = '23.11.2023'
-for f in filenames:
-    data_parser.process_experiment(f, date, substitution)
+if __name__ == '__main__':
+    data_parser = TM5103DataParser()
+    # filename = './../(2023_09_22)_RA.txt'
+    # filename = 'D:/JIHT/!2023/!Ларина/!Raw_ED/(2023_09_28)_Pyrocarbon/Reactor A/ARHrep/TM5103-4217863/StandartConfig/DB/230928141800/All_Chan.txt'
+    filenames = [
+        'D:/JIHT/!2023/!Ларина/!Processed_ED/tm5103-4217863.txt',
+        'D:/JIHT/!2023/!Ларина/!Processed_ED/tm5103-4217905.txt',
+    ]
+    substitution = {'tm5103-4217863': 'A', 'tm5103-4217905': 'B'}
+    # date = '22.09.2023'
+    date = '23.11.2023'
+    for f in filenames:
+        data_parser.process_experiment(f, date, substitution)
@@ -0,0 +1,175 @@
+import os
+import time
+
+from sources.tm5103_data_parser import TM5103DataParser
+
+
+class TM5103LogFollower:
+
+    def __init__(self, channel_count=8, reduce_lines=27, average_lines=27,
+        interval=0.5, encoding='utf-8', read_size=4*1024*1024):
+        self.channel_count = channel_count
+        self.reduce_lines = reduce_lines
+        self.average_lines = average_lines
+        self.interval = interval
+        self.encoding = encoding
+        self.read_size = read_size
+        self.__data_parser = TM5103DataParser()
+        self.__reset_state()
+
+    def __reset_state(self):
+        self.__offset = 0
+        self.__buffer = b''
+        self.__line_index = 0
+        self.__cur_date = None
+        self.__seen_dates = set()
+        # Файлы по датам перезаписываются только при обработке лога с
+        # нулевого смещения, иначе новые строки дописываются в их конец.
+        self.__truncate_days = True
+        self.__day_file = None
+        self.__window = self.__data_parser.create_average_window(
+            self.channel_count, self.average_lines)
+
+    def __make_title(self, date):
+        return '_'.join(reversed(date.split('.')))
+
+    def __open_day_file(self, date, output_dir):
+        self.__close_day_file()
+        output_file = f'{output_dir}/{self.__make_title(date)}'
+        if self.__truncate_days and date not in self.__seen_dates:
+            mode = 'w'
+        else:
+            mode = 'a'
+        try:
+            self.__day_file = open(output_file, mode)
+            self.__seen_dates.add(date)
+        except IOError:
+            print(f'I/O error with <{output_file}>!')
+
+    def __close_day_file(self):
+        if self.__day_file:
+            try:
+                self.__day_file.close()
+            except IOError:
+                print(f'I/O error with <{self.__day_file.name}>!')
+            self.__day_file = None
+
+    def __process_lines(self, lines, output_dir, outputs):
+        count = 0
+        for raw_line in lines:
+            data = raw_line.decode(self.encoding, errors='replace').split()
+            if len(data) < 2:
+                continue
+            if data[0] != self.__cur_date:
+                self.__cur_date = data[0]
+                self.__open_day_file(data[0], output_dir)
+            if self.__day_file:
+                try:
+                    self.__day_file.write('{}\n'.format('\t'.join(data[1:])))
+                except IOError:
+                    print(f'I/O error with <{self.__day_file.name}>!')
+            columns = data[1:self.channel_count+2]
+            if self.__line_index % self.reduce_lines == 0:
+                outputs['reduced'].write('{}\n'.format(';'.join(columns)))
+            self.__line_index += 1
+            values = [
+                self.__data_parser.convert_to_float(el) for el in columns[1:]]
+            values += [None] * (self.channel_count - len(values))
+            average = self.__data_parser.update_average_window(
+                self.__window, values)
+            outputs['average'].write('{}\n'.format(';'.join(
+                [columns[0]] + [self.__data_parser.convert_to_str(v) for v in average])))
+            count += 1
+        return count
+
+    # Смещение начала последней строки: если лог обрывается посреди строки,
+    # ее начало нужно прочитать, иначе первая строка будет разобрана со
+    # сдвигом столбцов.
+    def __find_line_start(self, filename):
+        with open(filename, 'rb') as f:
+            end = f.seek(0, os.SEEK_END)
+            while end > 0:
+                start = max(0, end - self.read_size)
+                f.seek(start)
+                index = f.read(end - start).rfind(b'\n')
+                if index >= 0:
+                    return start + index + 1
+                end = start
+        return 0
+
+    def poll(self, filename, output_dir, outputs):
+        try:
+            size = os.path.getsize(filename)
+        except OSError:
+            print(f'I/O error. Please, check <{filename}>.')
+            return 0
+        if size < self.__offset:
+            print(f'<{filename}> has been truncated, starting over.')
+            self.__close_day_file()
+            self.__reset_state()
+        if size == self.__offset:
+            return 0
+        count = 0
+        try:
+            with open(filename, 'rb') as f:
+                f.seek(self.__offset)
+                # Читаем блоками не больше read_size, чтобы первый проход по
+                # большому логу не загружал его в память целиком.
+                while self.__offset < size:
+                    new_data = f.read(min(self.read_size, size - self.__offset))
+                    if not new_data:
+                        break
+                    self.__offset += len(new_data)
+                    *lines, self.__buffer = (
+                        self.__buffer + new_data).split(b'\n')
+                    count += self.__process_lines(lines, output_dir, outputs)
+        except IOError:
+            print(f'I/O error. Please, check <{filename}>.')
+        if self.__day_file:
+            self.__day_file.flush()
+        for w in outputs.values():
+            w.flush()
+        return count
+
+    def follow(self, filename, output_dir, from_start=True, max_idle=None):
+        print(f'Following <{filename}>. Press Ctrl+C to stop.\n...')
+        self.__reset_state()
+        data_parser = self.__data_parser
+        if output_dir not in os.listdir():
+            try:
+                os.mkdir(output_dir)
+            except OSError:
+                print(f"Can't create <{output_dir}> directory")
+                return None
+        if not from_start:
+            self.__truncate_days = False
+            try:
+                self.__offset = self.__find_line_start(filename)
+            except OSError:
+                print(f'I/O error. Please, check <{filename}>.')
+                return None
+        mode = 'w' if from_start else 'a'
+        reduced_file = data_parser.create_new_filename(filename, 'reduced')
+        average_file = data_parser.create_new_filename(filename, 'average')
+        try:
+            with open(reduced_file, mode) as r, open(average_file, mode) as a:
+                outputs = {'reduced': r, 'average': a}
+                idle_time = 0.0
+                while max_idle is None or idle_time < max_idle:
+                    start_time = time.perf_counter()
+                    count = self.poll(filename, output_dir, outputs)
+                    if count:
+                        ms_time = round(
+                            (time.perf_counter() - start_time) * 1e3, 3)
+                        print(f'{count} new lines processed in {ms_time} ms.')
+                        idle_time = 0.0
+                    else:
+                        time.sleep(self.interval)
+                        idle_time += self.interval
+        except IOError:
+            print(f'I/O error with <{reduced_file}> or <{average_file}>.')
+        except KeyboardInterrupt:
+            print(f'Following of <{filename}> has been stopped.')
+        finally:
+            self.__close_day_file()
+        return None
@@ -0,0 +1,292 @@
+import os
+import struct
+from array import array
+from itertools import islice
+from operator import gt
+from datetime import date
+from time import perf_counter
+from typing import List, Dict, Optional, Union
+
+from sources.ar4_parser import Ar4Parser
+
+Columns = Dict[str, Union[array, List[array]]]
+
+
+class TM5103Merger():
+
+    def __init__(self):
+        self.channels_amount = 8
+        self.file_sep = ';'
+        self.channel_title = 'ТП'
+        self.missing_value = 'None'
+        self.ar4_ext = '.ar4'
+        self.__day_seconds = 86400
+        self.__readings = struct.Struct('>8f')
+        self.__ar4_parser = Ar4Parser()
+
+    # Временные метки хранятся как число секунд от 01.01.0001
+    # (date.toordinal()), поэтому разбор даты выполняется один раз на сутки,
+    # а не для каждой строки.
+    def __text_date_to_seconds(self, str_date: str, cache: Dict[str, int]) -> int:
+        seconds = cache.get(str_date)
+        if seconds is None:
+            day, month, year = (int(el) for el in str_date.split('.'))
+            seconds = date(year, month, day).toordinal() * self.__day_seconds
+            cache[str_date] = seconds
+        return seconds
+
+    def __text_time_to_seconds(self, str_time: str) -> int:
+        return (int(str_time[0:2]) * 3600 + int(str_time[3:5]) * 60 +
+            int(str_time[6:8]))
+
+    def __convert_to_float(self, _str: str) -> float:
+        try:
+            return float(_str.replace(',', '.'))
+        except ValueError:
+            return float('nan')
+
+    # Текстовый лог содержит 2-3 строки на одну секунду. Чтобы не терять
+    # порядок строк внутри секунды, k-я из m строк с одинаковой меткой
+    # получает метку t + k/m. Для неполной секунды в начале и в конце лога
+    # доли считаются только по имеющимся строкам. Метки архива .AR4
+    # обрабатываются так же, чтобы оба источника имели общую шкалу времени.
+    def __spread_within_seconds(self, timestamps: array) -> None:
+        start = 0
+        n = len(timestamps)
+        while start < n:
+            end = start + 1
+            while end < n and timestamps[end] == timestamps[start]:
+                end += 1
+            m = end - start
+            for k in range(1, m):
+                timestamps[start + k] += k / m
+            start = end
+        return None
+
+    # as-of объединение требует отсортированных меток. Сортировка
+    # устойчивая, поэтому строки одной секунды сохраняют исходный порядок.
+    def __sort_columns(self, unit: Columns) -> Columns:
+        timestamps = unit['timestamps']
+        if not any(map(gt, timestamps, islice(timestamps, 1, None))):
+            return unit
+        order = sorted(range(len(timestamps)), key=timestamps.__getitem__)
+        return {
+            'timestamps': array('d', map(timestamps.__getitem__, order)),
+            'channels': [array('d', map(channel.__getitem__, order))
+                for channel in unit['channels']]}
+
+    # Метки приводятся к целым секундам, сортируются и заново распределяются
+    # внутри секунды. Используется после чтения и при склейке файлов.
+    def prepare_columns(self, unit: Columns) -> Columns:
+        unit['timestamps'] = array('d', map(float, map(int, unit['timestamps'])))
+        unit = self.__sort_columns(unit)
+        self.__spread_within_seconds(unit['timestamps'])
+        return unit
+
+    def read_text_log(self, filename: str,
+        channel_count: Optional[int] = None) -> Columns:
+        _channel_count = (channel_count or self.channels_amount)
+        time_start = perf_counter()
+        timestamps = array('d')
+        channels = [array('d') for _ in range(_channel_count)]
+        cache: Dict[str, int] = {}
+        skipped = 0
+        try:
+            with open(filename, 'r') as f:
+                for line in f:
+                    data = line.split()
+                    if len(data) < 2:
+                        continue
+                    try:
+                        timestamp = (
+                            self.__text_date_to_seconds(data[0], cache) +
+                            self.__text_time_to_seconds(data[1]))
+                    except ValueError:
+                        skipped += 1
+                        continue
+                    timestamps.append(timestamp)
+                    values = data[2:_channel_count+2]
+                    for i, channel in enumerate(channels):
+                        channel.append(self.__convert_to_float(values[i])
+                            if i < len(values) else float('nan'))
+            print('Read {} lines of <{}> in {:.2f} ms.'.format(
+                len(timestamps), filename, (perf_counter() - time_start)*1e3))
+        except IOError as err:
+            print(f'Error with <{filename}>:\n{err}.')
+        if skipped:
+            print(f'{skipped} lines with wrong timestamp skipped in <{filename}>.')
+        unit = self.__sort_columns(
+            {'timestamps': timestamps, 'channels': channels})
+        self.__spread_within_seconds(unit['timestamps'])
+        return unit
+
+    def read_ar4_records(self, records: List[bytes]) -> Columns:
+        time_start = perf_counter()
+        timestamps = array('d')
+        channels = [array('d') for _ in range(self.channels_amount)]
+        # Упакованная метка времени АЦП монотонна, поэтому сортировка
+        # выполняется по целым числам, без создания datetime.
+        packed = [struct.unpack_from('<I', record, 2)[0] for record in records]
+        order = range(len(records))
+        if any(a > b for a, b in zip(packed, packed[1:])):
+            order = sorted(order, key=packed.__getitem__)
+        cache: Dict[int, int] = {}
+        nan = float('nan')
+        for i in order:
+            ts = packed[i]
+            day_seconds = cache.get(ts >> 17)
+            if day_seconds is None:
+                year, month, day = self.__ar4_parser.get_unit_datetime(ts)[:3]
+                day_seconds = date(year, month, day).toordinal() * self.__day_seconds
+                cache[ts >> 17] = day_seconds
+            timestamps.append(day_seconds + (ts >> 12 & 0b11111) * 3600 +
+                (ts >> 6 & 0b111111) * 60 + (ts & 0b111111))
+            record = records[i]
+            err = record[8]
+            for j, value in enumerate(self.__readings.unpack_from(record, 9)):
+                channels[j].append(nan if err >> j & 1 else value)
+        self.__spread_within_seconds(timestamps)
+        print('{} records converted to columns in {:.2f} ms.'.format(
+            len(timestamps), (perf_counter() - time_start)*1e3))
+        return {'timestamps': timestamps, 'channels': channels}
+
+    # Два указателя за один проход: j - последняя метка other, не
+    # превышающая t. Индекс -1 означает отсутствие значения в пределах
+    # допуска tolerance (в секундах; 0 - только точное совпадение).
+    def asof_indices(self, base: array, other: array, tolerance: float = 1,
+        direction: str = 'nearest') -> array:
+        result = array('q')
+        append = result.append
+        inf = float('inf')
+        n = len(other)
+        nearest = direction == 'nearest'
+        j = -1
+        prev_t = -inf
+        next_t = other[0] if n else inf
+        for t in base:
+            while next_t <= t:
+                j += 1
+                prev_t = next_t
+                next_t = other[j+1] if j + 1 < n else inf
+            if nearest and next_t - t < t - prev_t:
+                append(j + 1 if next_t - t <= tolerance else -1)
+            else:
+                append(j if t - prev_t <= tolerance else -1)
+        return result
+
+    # Результат хранит для каждого прибора индексы его строк, совпавших со
+    # строками первого прибора, а не скопированные столбцы: копирование
+    # столбцов стоило бы больше, чем само объединение. Столбец целиком
+    # можно получить через get_merged_channel.
+    def merge(self, units: Dict[str, Columns], tolerance: float = 1,
+        direction: str = 'nearest') -> Columns:
+        if direction not in ('nearest', 'previous'):
+            print(f'Wrong direction <{direction}>: use "nearest" or "previous".')
+            return {}
+        if not units:
+            return {}
+        time_start = perf_counter()
+        base_prefix, base = next(iter(units.items()))
+        header = []
+        merged_units = []
+        for n, (prefix, unit) in enumerate(units.items()):
+            header.extend(['{}_{}{}'.format(prefix, self.channel_title, i + 1)
+                for i in range(len(unit['channels']))])
+            indices = None
+            if n != 0:
+                indices = self.asof_indices(
+                    base['timestamps'], unit['timestamps'], tolerance, direction)
+            merged_units.append(
+                {'indices': indices, 'channels': unit['channels']})
+        print('{} units merged on <{}> in {:.2f} ms.'.format(
+            len(units), base_prefix, (perf_counter() - time_start)*1e3))
+        return {
+            'header': header, 'timestamps': base['timestamps'],
+            'units': merged_units}
+
+    def get_merged_channel(self, merged: Columns, column: int) -> array:
+        for unit in merged['units']:
+            if column >= len(unit['channels']):
+                column -= len(unit['channels'])
+                continue
+            channel = unit['channels'][column]
+            if unit['indices'] is None:
+                return channel
+            extended = channel + array('d', [float('nan')])
+            return array('d', map(extended.__getitem__, unit['indices']))
+        raise IndexError(f'There is no column <{column}> in merged data')
+
+    def __format_value(self, value: float) -> str:
+        if value != value:
+            return self.missing_value
+        return '{:.6f}'.format(value).replace('.', ',')
+
+    def write_merged_to_file(self, merged: Columns, filename: str,
+        sep: Optional[str] = None) -> None:
+        file_sep = (sep or self.file_sep)
+        cache: Dict[int, str] = {}
+        try:
+            with open(filename, 'w') as f:
+                f.write(file_sep.join(['Дата', 'Время', *merged['header']]))
+                f.write('\n')
+                for i, ts in enumerate(merged['timestamps']):
+                    day, seconds = divmod(int(ts), self.__day_seconds)
+                    str_date = cache.get(day)
+                    if str_date is None:
+                        str_date = date.fromordinal(day).strftime('%d.%m.%Y')
+                        cache[day] = str_date
+                    values = [str_date, '{:02d}:{:02d}:{:02d}'.format(
+                        seconds // 3600, seconds // 60 % 60, seconds % 60)]
+                    for unit in merged['units']:
+                        k = i if unit['indices'] is None else unit['indices'][i]
+                        if k < 0:
+                            values.extend(
+                                [self.missing_value] * len(unit['channels']))
+                        else:
+                            values.extend([self.__format_value(channel[k])
+                                for channel in unit['channels']])
+                    f.write(file_sep.join(values))
+                    f.write('\n')
+        except IOError:
+            print(f'Error with <{filename}>.')
+        return None
+
+    def read_unit(self, filename: str, substitution: Dict[str, str]):
+        path, fname = os.path.split(filename)
+        name, ext = os.path.splitext(fname)
+        if ext.lower() == self.ar4_ext:
+            raw_data = self.__ar4_parser.parse_ar4_file(filename)
+            unit_name = 'tm5103-{}'.format(raw_data['metadata']['unit_number'])
+            return (substitution.get(unit_name, unit_name),
+                self.read_ar4_records(raw_data['records']))
+        return (substitution.get(name, name), self.read_text_log(filename))
+
+    # Файлы с одинаковым префиксом (например, лог одного прибора из разных
+    # папок) склеиваются в один прибор.
+    def read_units(self, filenames: List[str],
+        substitution: Dict[str, str]) -> Dict[str, Columns]:
+        units: Dict[str, Columns] = {}
+        for filename in filenames:
+            prefix, unit = self.read_unit(filename, substitution)
+            if prefix not in units:
+                units[prefix] = unit
+                continue
+            print(f'<{filename}> is appended to unit <{prefix}>.')
+            stored = units[prefix]
+            if len(stored['channels']) != len(unit['channels']):
+                print(f'Channel count mismatch in <{filename}>, skipped.')
+                continue
+            stored['timestamps'].extend(unit['timestamps'])
+            for channel, new_channel in zip(stored['channels'], unit['channels']):
+                channel.extend(new_channel)
+            units[prefix] = self.prepare_columns(stored)
+        return units
+
+    def merge_files(self, filenames: List[str], substitution: Dict[str, str],
+        output_file: str, tolerance: float = 1,
+        direction: str = 'nearest') -> Columns:
+        units = self.read_units(filenames, substitution)
+        merged = self.merge(units, tolerance, direction)
+        if merged:
+            self.write_merged_to_file(merged, output_file)
+        return merged
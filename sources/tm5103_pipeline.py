@@ -0,0 +1,288 @@
+import os
+import queue
+import threading
+from time import perf_counter
+from typing import List, Dict, Optional, Iterable, Tuple, Union
+
+from sources.ar4_parser import Ar4Parser
+from sources.tm5103_data_parser import TM5103DataParser
+
+Write_job = Tuple[str, Iterable[str]]
+
+
+# Конвейер: поток чтения -> поток декодирования -> потоки записи.
+# Стадии связаны очередями ограниченного размера, поэтому быстрая стадия
+# блокируется, пока медленная не освободит место (backpressure). Ошибка
+# в любой стадии останавливает остальные и повторно возбуждается в
+# вызывающем потоке после их завершения.
+class TM5103Pipeline():
+
+    def __init__(self):
+        self.queue_size = 16
+        self.writers_amount = 3
+        self.batch_chunks = 4096
+        self.batch_lines = 10000
+        self.timeout = 0.1
+        self.file_sep = ';'
+        self.__end = object()
+        self.__ar4_parser = Ar4Parser()
+        self.__data_parser = TM5103DataParser()
+
+    def config_pipeline(self, config: Dict[str, Union[int, float]]) -> None:
+        if 'queue_size' in config:
+            self.queue_size = config['queue_size']
+        if 'writers_amount' in config:
+            self.writers_amount = config['writers_amount']
+        if 'batch_chunks' in config:
+            self.batch_chunks = config['batch_chunks']
+        if 'batch_lines' in config:
+            self.batch_lines = config['batch_lines']
+        if 'timeout' in config:
+            self.timeout = config['timeout']
+        return None
+
+    def __put(self, q: queue.Queue, item, stop: threading.Event) -> bool:
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=self.timeout)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def __get(self, q: queue.Queue, stop: threading.Event):
+        while not stop.is_set():
+            try:
+                return q.get(timeout=self.timeout)
+            except queue.Empty:
+                pass
+        return self.__end
+
+    def __run_stage(self, target, errors: list, stop: threading.Event, *args) -> None:
+        try:
+            target(stop, *args)
+        except Exception as err:
+            errors.append(err)
+            stop.set()
+        return None
+
+    def __start(self, target, errors: list, stop: threading.Event,
+        *args) -> threading.Thread:
+        thread = threading.Thread(
+            target=self.__run_stage, args=(target, errors, stop, *args),
+            daemon=True)
+        thread.start()
+        return thread
+
+    def __join(self, threads: List[threading.Thread], errors: list,
+        title: str, time_start: float) -> None:
+        for thread in threads:
+            thread.join()
+        if errors:
+            print(f'Pipeline error with <{title}>: {errors[0]}')
+            raise errors[0]
+        print('<{}> has been processed in {:.2f} ms.'.format(
+            title, (perf_counter() - time_start)*1e3))
+        return None
+
+    def __read_bytes(self, stop: threading.Event, filename: str,
+        batch_size: int, q_out: queue.Queue) -> None:
+        with open(filename, 'rb') as f:
+            batch = f.read(batch_size)
+            while batch:
+                if not self.__put(q_out, batch, stop):
+                    return None
+                batch = f.read(batch_size)
+        self.__put(q_out, self.__end, stop)
+        return None
+
+    def __read_lines(self, stop: threading.Event, filename: str,
+        q_out: queue.Queue) -> None:
+        with open(filename, 'r') as f:
+            batch = f.readlines(self.batch_lines * 128)
+            while batch:
+                if not self.__put(q_out, batch, stop):
+                    return None
+                batch = f.readlines(self.batch_lines * 128)
+        self.__put(q_out, self.__end, stop)
+        return None
+
+    def __write_files(self, stop: threading.Event, q_in: queue.Queue) -> None:
+        job = self.__get(q_in, stop)
+        while job is not self.__end:
+            filename, lines = job
+            with open(filename, 'w') as w:
+                w.writelines(lines)
+            job = self.__get(q_in, stop)
+        # Передаем признак конца остальным потокам записи.
+        self.__put(q_in, self.__end, stop)
+        return None
+
+    def __start_writers(self, errors: list, stop: threading.Event,
+        q_in: queue.Queue) -> List[threading.Thread]:
+        return [
+            self.__start(self.__write_files, errors, stop, q_in)
+            for _ in range(self.writers_amount)]
+
+    def __decode_ar4(self, stop: threading.Event, q_in: queue.Queue,
+        q_out: queue.Queue, output_dir: str, sep: str) -> None:
+        parser = self.__ar4_parser
+        chunk_size = parser.chunk_size
+        empty_chunk = chunk_size*parser.empty_byte
+        not_datetime = 4*parser.empty_byte
+        header = None
+        result: Dict[int, List[dict]] = {}
+        batch = self.__get(q_in, stop)
+        while batch is not self.__end:
+            for i in range(0, len(batch), chunk_size):
+                chunk = batch[i:i+chunk_size]
+                if header is None:
+                    header = chunk
+                    continue
+                if chunk == empty_chunk:
+                    continue
+                for record in parser.extract_records(chunk, parser.empty_byte):
+                    if record[2:6] == not_datetime:
+                        continue
+                    int_date = parser.get_int_date(record[4:6])
+                    decrypted_record = parser.decrypt_record(record)
+                    if int_date in result:
+                        result[int_date].append(decrypted_record)
+                    else:
+                        result[int_date] = [decrypted_record]
+            batch = self.__get(q_in, stop)
+        if stop.is_set() or header is None:
+            self.__put(q_out, self.__end, stop)
+            return None
+        unit_number = parser.get_unit_number_and_creation_datetime(
+            header)['unit_number']
+        # Архив - кольцевой буфер, поэтому дата считается полной только в
+        # конце файла: запись файлов начинается после декодирования, и
+        # запись одной даты идет параллельно с форматированием других.
+        for int_date in sorted(result):
+            records = sorted(result[int_date], key=lambda d: d['datetime'])
+            filename = os.path.join(output_dir, parser.create_filename(
+                unit_number, records[0]['datetime'], records[-1]['datetime']))
+            lines = (f'{parser.convert_decrypted_record_to_str(r, sep)}\n'
+                for r in records)
+            if not self.__put(q_out, (filename, lines), stop):
+                return None
+        self.__put(q_out, self.__end, stop)
+        return None
+
+    def export_ar4_by_dates(self, filename: str, output_dir: str = '.',
+        sep: Optional[str] = None) -> None:
+        file_sep = (sep or self.file_sep)
+        time_start = perf_counter()
+        if not os.path.isdir(output_dir):
+            try:
+                os.mkdir(output_dir)
+            except OSError:
+                print(f"Can't create <{output_dir}> directory")
+                return None
+        errors: list = []
+        stop = threading.Event()
+        q_raw: queue.Queue = queue.Queue(self.queue_size)
+        q_write: queue.Queue = queue.Queue(self.queue_size)
+        batch_size = self.__ar4_parser.chunk_size*self.batch_chunks
+        threads = [
+            self.__start(self.__read_bytes, errors, stop,
+                filename, batch_size, q_raw),
+            self.__start(self.__decode_ar4, errors, stop,
+                q_raw, q_write, output_dir, file_sep),
+            *self.__start_writers(errors, stop, q_write)]
+        self.__join(threads, errors, filename, time_start)
+        return None
+
+    def __make_title(self, date: str) -> str:
+        return '_'.join(reversed(date.split('.')))
+
+    def __split_lines(self, stop: threading.Event, q_in: queue.Queue,
+        q_out: queue.Queue) -> None:
+        batch = self.__get(q_in, stop)
+        while batch is not self.__end:
+            cur_date, lines = None, []
+            for line in batch:
+                data = line.split()
+                if not data:
+                    continue
+                if data[0] != cur_date:
+                    if lines and not self.__put(q_out, (cur_date, lines), stop):
+                        return None
+                    cur_date, lines = data[0], []
+                lines.append('{}\n'.format('\t'.join(data[1:])))
+            if lines and not self.__put(q_out, (cur_date, lines), stop):
+                return None
+            batch = self.__get(q_in, stop)
+        self.__put(q_out, self.__end, stop)
+        return None
+
+    # Строки одной даты должны попасть в файл по порядку, поэтому при
+    # разбиении текстового лога используется один поток записи.
+    def __write_days(self, stop: threading.Event, q_in: queue.Queue,
+        output_dir: str) -> None:
+        cur_date, w = None, None
+        try:
+            item = self.__get(q_in, stop)
+            while item is not self.__end:
+                date, lines = item
+                if date != cur_date:
+                    if w:
+                        w.close()
+                    cur_date = date
+                    w = open(f'{output_dir}/{self.__make_title(date)}', 'w')
+                w.writelines(lines)
+                item = self.__get(q_in, stop)
+        finally:
+            if w:
+                w.close()
+        return None
+
+    def split_text_file(self, filename: str, output_dir: str) -> None:
+        time_start = perf_counter()
+        if not os.path.isdir(output_dir):
+            try:
+                os.mkdir(output_dir)
+            except OSError:
+                print(f"Can't create <{output_dir}> directory")
+                return None
+        errors: list = []
+        stop = threading.Event()
+        q_raw: queue.Queue = queue.Queue(self.queue_size)
+        q_write: queue.Queue = queue.Queue(self.queue_size)
+        threads = [
+            self.__start(self.__read_lines, errors, stop, filename, q_raw),
+            self.__start(self.__split_lines, errors, stop, q_raw, q_write),
+            self.__start(self.__write_days, errors, stop, q_write, output_dir)]
+        self.__join(threads, errors, filename, time_start)
+        return None
+
+    def __join_lines(self, data: List[List[str]]) -> List[str]:
+        return ['\n'.join([';'.join(line) for line in data])]
+
+    def process_experiment(self, filename: str, date: str,
+        substitution: Dict[str, str]) -> None:
+        time_start = perf_counter()
+        data_parser = self.__data_parser
+        errors: list = []
+        stop = threading.Event()
+        q_write: queue.Queue = queue.Queue(self.queue_size)
+        writers = self.__start_writers(errors, stop, q_write)
+        raw_data = data_parser.extract_single_date(filename, date)
+        path, fname = os.path.split(filename)
+        suffix = data_parser.define_reactor(fname, substitution)
+        date_filename = os.path.join(path, f'{self.__make_title(date)}_{suffix}')
+        # Каждый файл записывается в отдельном потоке, пока вычисляются
+        # данные для следующего.
+        self.__put(q_write, (date_filename, self.__join_lines(raw_data)), stop)
+        col_data = data_parser.extract_columns_new(raw_data, list(range(9)))
+        self.__put(q_write, (
+            data_parser.create_new_filename(date_filename, 'c'),
+            self.__join_lines(col_data)), stop)
+        reduced_data = data_parser.reduce_data(col_data, 27)
+        self.__put(q_write, (
+            data_parser.create_new_filename(date_filename, 'reduced'),
+            self.__join_lines(reduced_data)), stop)
+        self.__put(q_write, self.__end, stop)
+        self.__join(writers, errors, filename, time_start)
+        return None
@@ -1,14 +1,15 @@
 #!/usr/bin/python
 # -*- coding: utf-8 -*-
-import csv
-from datetime import datetime
-from argparse import ArgumentParser
-from sources.tm5103_data_parser import TM5103DataParser
-from sources.tm5103_time_changer import TM5103TimeChanger
-from sources.tm5103_graph import TM5103GraphMaker
+import os
+from argparse import ArgumentParser, ArgumentTypeError
+
+# Модули обработки импортируются внутри подкоманд, поэтому запуск легких
+# команд из планировщиков и скриптов не тратит время на лишние импорты.
 
 
 def read_settings(filename, _sep):
+    import csv
+    from datetime import datetime
     result = {
         'output_dir': 'data_files',
         'channel_count': 4,
@@ -33,70 +34,228 @@ def read_settings(filename, _sep):
             print(f'Check {filename}: wrong <channel_count>')
     if settings.get('new_time'):
         try:
-            result['new_time'] = datetime.strptime(settings['new_time'], '%H:%M:%S')
+            result['new_time'] = datetime.strptime(settings['new_time'].strip(), '%H:%M:%S')
         except ValueError:
             print(f'Check {filename}: wrong <new_time>')
-    return result   
+    return result
 
-def create_parser():
-    parser = ArgumentParser()
-    group = parser.add_mutually_exclusive_group()
-    group.add_argument('-s', '--split', action='store_true')
-    group.add_argument('-a', '--average', action='store_true')
-    group.add_argument('-t', '--time', action='store_true')
-    group.add_argument('-g', '--graph', action='store_true')
-    group.add_argument('-e', '--extract', action='store_true')
-    group.add_argument('-r', '--reduce', action='store_true')
-    group.add_argument('-c', '--columns', action='store_true')
-    parser.add_argument('filename', nargs='?')
 
-    return parser
+def get_channel_count(args):
+    if args.channels:
+        return args.channels
+    return read_settings(args.settings, ';')['channel_count']
 
 
-if __name__ == '__main__':
-    print('This is tm5103 data processing!')
-    print(read_settings('settings.csv', ';'))
-    argparser = create_parser()
-    # args = argparser.parse_args(['-s', './(2023_09_22)_RA.txt'])
-    # args = argparser.parse_args(['-g', './data/2023_09_22.txt'])
-    # args = argparser.parse_args(['-e', './(2023_09_22)_RA.txt'])
-    args = argparser.parse_args(['-c', './(2023_09_22).txt'])
-    
-    if args.split:
-        print('Split <%s>' % args.filename)
-        output_dir = 'data_files'
-        data_parser = TM5103DataParser()
-        data_parser.parse_file(args.filename, output_dir)
-        # data_parser.split_file(args.filename, 8)
-    elif args.extract:
+def parse_unit_datetime(value):
+    from datetime import datetime
+    for frm in ('%d.%m.%Y %H:%M:%S', '%d.%m.%Y'):
+        try:
+            return tuple(datetime.strptime(value.strip(), frm).timetuple())[:6]
+        except ValueError:
+            pass
+    raise ArgumentTypeError(
+        f'wrong datetime <{value}>, use dd.mm.yyyy [HH:MM:SS]')
+
+
+def split_command(args):
+    output_dir = (args.output_dir or read_settings(args.settings, ';')['output_dir'])
+    if args.pipeline:
+        from sources.tm5103_pipeline import TM5103Pipeline
+        pipeline = TM5103Pipeline()
+        for filename in args.filenames:
+            try:
+                pipeline.split_text_file(filename, output_dir)
+            except OSError:
+                print(f'I/O error. Please, check <{filename}>.')
+    else:
+        from sources.tm5103_data_parser import TM5103DataParser
         data_parser = TM5103DataParser()
-        date = '29.09.2023'
-        data = data_parser.extract_single_date(args.filename, date)
+        for filename in args.filenames:
+            data_parser.parse_file(filename, output_dir)
+
+
+def extract_command(args):
+    from sources.tm5103_data_parser import TM5103DataParser
+    data_parser = TM5103DataParser()
+    prefix = '_'.join(reversed(args.date.split('.')))
+    for filename in args.filenames:
+        data = data_parser.extract_single_date(filename, args.date)
         if data:
-            output_file = f'({"_".join(reversed(date.split(".")))}).txt' 
+            path, fname = os.path.split(filename)
+            name, _ = os.path.splitext(fname)
+            output_file = os.path.join(path, f'({prefix})_{name}.txt')
             data_parser.write_data_to_file(data, output_file)
         else:
-            print(f'There is no such a date <{date}> in <{args.filename}>')
-    elif args.reduce:
-        data_parser = TM5103DataParser()
-    elif args.columns:
-        data_parser = TM5103DataParser()
-        str_data = data_parser.extract_columns(args.filename, list(range(9)))
-        data = data_parser.extract_data(str_data)
-        reduced_data = data_parser.reduce_data(data, 27)
-        # reduced_data = data_parser.reduce_data(data, 1)
-        print(*reduced_data, sep='\n')
-    elif args.average:
-        print('Average <%s>' % args.filename)
-    elif args.time:
-        print('Time change at <%s>' % args.filename)
-        time_changer = TM5103TimeChanger()
-        time_changer.set_separator('\t')
-        time_changer.set_time_format('%H:%M:%S')
-        new_time = '07:00:00'
-        time_changer.change_time(args.filename, new_time)
-    elif args.graph:
-        graph_maker = TM5103GraphMaker()
-        header = ['Время', 'ТП1', 'ТП2', 'ТП3', 'ТП4', 'ТП5', 'ТП6', 'ТП7', 'ТП8']
-        graph_maker.create_graph('./sources/2023_09_22_processed.txt', header)
-        print('Graph <%s>' % args.filename)
+            print(f'There is no such a date <{args.date}> in <{filename}>')
+
+
+def reduce_command(args):
+    from sources.tm5103_data_parser import TM5103DataParser
+    data_parser = TM5103DataParser()
+    columns = list(range(get_channel_count(args) + 1))
+    for filename in args.filenames:
+        str_data = data_parser.extract_columns(filename, columns)
+        reduced_data = data_parser.reduce_data(str_data, args.lines)
+        data_parser.write_data_to_file(
+            reduced_data, data_parser.create_new_filename(filename, 'reduced'))
+
+
+def average_command(args):
+    from sources.tm5103_data_parser import TM5103DataParser
+    data_parser = TM5103DataParser()
+    columns = list(range(get_channel_count(args) + 1))
+    for filename in args.filenames:
+        str_data = data_parser.extract_columns(filename, columns)
+        average_data = data_parser.average_data(str_data, args.lines)
+        data_parser.write_data_to_file(
+            average_data, data_parser.create_new_filename(filename, 'average'))
+
+
+def time_command(args):
+    from sources.tm5103_time_changer import TM5103TimeChanger
+    new_time = args.new_time
+    if not new_time:
+        new_time = read_settings(args.settings, ';')['new_time'].strftime('%H:%M:%S')
+    time_changer = TM5103TimeChanger()
+    time_changer.set_separator('\t')
+    time_changer.set_time_format('%H:%M:%S')
+    for filename in args.filenames:
+        time_changer.change_time(filename, new_time)
+
+
+def graph_command(args):
+    try:
+        from sources.tm5103_graph import TM5103GraphMaker
+    except ImportError as err:
+        print(f'Graphs are not available: {err}.')
+        return None
+    graph_maker = TM5103GraphMaker()
+    header = ['Время', 'ТП1', 'ТП2', 'ТП3', 'ТП4', 'ТП5', 'ТП6', 'ТП7', 'ТП8']
+    for filename in args.filenames:
+        print('Graph <%s>' % filename)
+        graph_maker.create_graph(filename, header)
+
+
+def ar4_export_command(args):
+    if args.by_dates:
+        from sources.tm5103_pipeline import TM5103Pipeline
+        pipeline = TM5103Pipeline()
+        for filename in args.filenames:
+            try:
+                pipeline.export_ar4_by_dates(
+                    filename, args.output_dir or '.', args.sep)
+            except OSError:
+                print(f'I/O error. Please, check <{filename}>.')
+        return None
+    from sources.ar4_parser import Ar4Parser
+    ar4_parser = Ar4Parser()
+    for filename in args.filenames:
+        if not os.path.isfile(filename):
+            print(f'I/O error. Please, check <{filename}>.')
+            continue
+        raw_data = ar4_parser.parse_ar4_file(filename)
+        if args.start and args.end:
+            ar4_parser.extract_time_period_from_outside(
+                raw_data, args.start, args.end, args.sep, write_to_file=True)
+        else:
+            ar4_parser.extract_last_date_from_outside(
+                raw_data, args.sep, write_to_file=True)
+
+
+def follow_command(args):
+    from sources.tm5103_log_follower import TM5103LogFollower
+    output_dir = (args.output_dir or read_settings(args.settings, ';')['output_dir'])
+    follower = TM5103LogFollower(get_channel_count(args), interval=args.interval)
+    follower.follow(args.filename, output_dir, from_start=not args.from_end)
+
+
+def merge_command(args):
+    from sources.tm5103_merger import TM5103Merger
+    substitution = dict(el.split('=', 1) for el in args.substitution)
+    TM5103Merger().merge_files(
+        args.filenames, substitution, args.output, args.tolerance,
+        args.direction)
+
+
+def create_parser():
+    parser = ArgumentParser(description='This is tm5103 data processing!')
+    parser.add_argument('--settings', default='settings.csv')
+    subparsers = parser.add_subparsers(dest='command')
+
+    split = subparsers.add_parser('split', help='split text log by dates')
+    split.add_argument('-o', '--output-dir')
+    split.add_argument('-p', '--pipeline', action='store_true')
+    split.set_defaults(func=split_command)
+
+    extract = subparsers.add_parser('extract', help='extract single date')
+    extract.add_argument('-d', '--date', required=True)
+    extract.set_defaults(func=extract_command)
+
+    reduce = subparsers.add_parser('reduce', help='keep every n-th line')
+    reduce.add_argument('-n', '--lines', type=int, default=27)
+    reduce.set_defaults(func=reduce_command)
+
+    average = subparsers.add_parser('average', help='rolling average')
+    average.add_argument('-n', '--lines', type=int, default=27)
+    average.set_defaults(func=average_command)
+
+    time = subparsers.add_parser('time', help='shift time to new start')
+    time.add_argument('-t', '--new-time')
+    time.set_defaults(func=time_command)
+
+    graph = subparsers.add_parser('graph', help='plot processed data')
+    graph.set_defaults(func=graph_command)
+
+    ar4_export = subparsers.add_parser('ar4-export', help='export .AR4 to csv')
+    ar4_export.add_argument('--start', type=parse_unit_datetime,
+        help='dd.mm.yyyy [HH:MM:SS]')
+    ar4_export.add_argument('--end', type=parse_unit_datetime,
+        help='dd.mm.yyyy [HH:MM:SS]')
+    ar4_export.add_argument('-b', '--by-dates', action='store_true')
+    ar4_export.add_argument('-o', '--output-dir')
+    ar4_export.add_argument('--sep', default=';')
+    ar4_export.set_defaults(func=ar4_export_command)
+
+    merge = subparsers.add_parser('merge', help='merge units by time')
+    merge.add_argument('-o', '--output', default='merged.csv')
+    merge.add_argument('--tolerance', type=float, default=1)
+    merge.add_argument('--direction', choices=['nearest', 'previous'],
+        default='nearest')
+    merge.add_argument('-s', '--substitution', nargs='*',
+        default=['tm5103-4217863=A', 'tm5103-4217905=B'])
+    merge.set_defaults(func=merge_command)
+
+    for subparser in (split, extract, reduce, average, time, graph,
+        ar4_export, merge):
+        subparser.add_argument('filenames', nargs='+')
+    for subparser in (reduce, average):
+        subparser.add_argument('-c', '--channels', type=int)
+
+    follow = subparsers.add_parser('follow', help='follow growing text log')
+    follow.add_argument('-o', '--output-dir')
+    follow.add_argument('-c', '--channels', type=int)
+    follow.add_argument('-i', '--interval', type=float, default=0.5)
+    follow.add_argument('--from-end', action='store_true')
+    follow.add_argument('filename')
+    follow.set_defaults(func=follow_command)
+
+    return parser
+
+
+def main(argv=None):
+    argparser = create_parser()
+    args = argparser.parse_args(argv)
+    if not args.command:
+        argparser.print_help()
+        return None
+    if args.command == 'ar4-export':
+        if (args.start is None) != (args.end is None):
+            argparser.error('ar4-export: --start and --end must be given together')
+        if args.start is not None and args.start >= args.end:
+            argparser.error('ar4-export: --start must be earlier than --end')
+    args.func(args)
+    return None
+
+
+if __name__ == '__main__':
+    main()